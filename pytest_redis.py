@@ -1,5 +1,7 @@
 """pytest-redis queue plugin implementation."""
+import json
 import os
+import random
 
 import redis
 import pytest
@@ -35,6 +37,106 @@ def pytest_addoption(parser):
                            'If the main redis-list-key is not empty then ran '
                            'tests are pushed to this list.'),
                      required=False)
+    parser.addoption('--redis-shard-count',
+                     metavar='redis_shard_count',
+                     type=int,
+                     default=None,
+                     help=('The number of shards the redis list is split '
+                           'across. With more than one shard the lists are '
+                           'stored under the keys <redis-list-key>:<index> '
+                           'and <redis-backup-list-key>:<index>. Defaults '
+                           'to the number of redis-shard-hosts, or 1.'),
+                     required=False)
+    parser.addoption('--redis-shard-hosts',
+                     metavar='redis_shard_hosts',
+                     type=str,
+                     default=None,
+                     help=('A comma separated list of host:port pairs the '
+                           'shards are spread across, shard i living on '
+                           'entry i modulo the number of entries. Defaults '
+                           'to redis-host and redis-port for every shard.'),
+                     required=False)
+    parser.addoption('--redis-home-shard',
+                     metavar='redis_home_shard',
+                     type=int,
+                     default=None,
+                     help=('The shard this run consumes from first before '
+                           'stealing from the others once it is empty. '
+                           'Defaults to a random shard.'),
+                     required=False)
+    parser.addoption('--redis-record-durations',
+                     metavar='redis_record_durations',
+                     type=str,
+                     default=None,
+                     help=('A file the setup, call and teardown durations '
+                           'of every test are appended to as JSON lines. '
+                           'Several workers and runs may share the same '
+                           'file. The recording can be replayed with '
+                           'pytest_redis_simulator, which uses the median '
+                           'durations of tests recorded more than once.'),
+                     required=False)
+
+
+def pytest_configure(config):
+    """Register the duration recorder when requested."""
+    record_path = config.getoption('redis_record_durations')
+    if record_path is not None:
+        config.pluginmanager.register(DurationRecorder(record_path),
+                                      'redis_duration_recorder')
+
+
+class DurationRecorder(object):
+    """Append the phase durations of every test ran to a file."""
+
+    def __init__(self, path):
+        """Record the durations to the file at `path`."""
+        self.path = path
+        self.durations = {}
+
+    def pytest_runtest_logreport(self, report):
+        """Write the durations of a test once its teardown is reported."""
+        durations = self.durations.setdefault(report.nodeid, {})
+        durations[report.when] = report.duration
+        if report.when != 'teardown':
+            return
+
+        del self.durations[report.nodeid]
+        record = {
+            'nodeid': report.nodeid,
+            'worker': os.getpid(),
+            'setup': durations.get('setup', 0.0),
+            'call': durations.get('call', 0.0),
+            'teardown': durations['teardown']
+        }
+        with open(self.path, 'a') as record_file:
+            record_file.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+def get_shard_key(key, shard_index, shard_count):
+    """Return the redis key of a shard of the given list key."""
+    if key is None or shard_count == 1:
+        return key
+    return "%s:%d" % (key, shard_index)
+
+
+def push_tests_to_shards(shard_connections, list_key, test_paths):
+    """Distribute test paths round-robin across the shards of a list key.
+
+    `shard_connections` holds one redis connection per shard, as returned
+    by connect_to_shards for the --redis-shard-hosts and
+    --redis-shard-count given to the workers.
+    """
+    shard_count = len(shard_connections)
+    pipelines = [connection.pipeline(transaction=False)
+                 for connection in shard_connections]
+    for index, test_path in enumerate(test_paths):
+        shard_index = index % shard_count
+        pipelines[shard_index].lpush(get_shard_key(list_key,
+                                                   shard_index,
+                                                   shard_count),
+                                     test_path)
+    for pipeline in pipelines:
+        pipeline.execute()
 
 
 def retrieve_test_from_redis(redis_connection, list_key, backup_list_key):
@@ -65,22 +167,101 @@ def get_redis_connection(config):
     return r_client
 
 
-def populate_test_generator(session, redis_connection):
-    """Create a test path generator that consumes from the main redis list.
+def parse_shard_host(address):
+    """Return the (host, port) of a host:port or [ipv6]:port address."""
+    host, _, port = address.strip().rpartition(":")
+    if host.startswith("[") and host.endswith("]"):
+        host = host[1:-1]
+    elif ":" in host:
+        host = ""
+    if not host or not port.isdigit():
+        raise ValueError("Invalid redis shard host '%s', expected host:port "
+                         "or [ipv6]:port" % address)
+    return host, int(port)
+
 
-    This first checks the backup list for any entries and pushes them to the main
-    redis list before returning a generator to that list.
+def connect_to_shards(shard_hosts, shard_count=None):
+    """Return a list holding the redis connection of each shard.
+
+    `shard_hosts` is a comma separated list of host:port pairs, shard i
+    living on entry i modulo the number of entries, and `shard_count`
+    defaults to the number of entries. This is the mapping the workers
+    use for --redis-shard-hosts and --redis-shard-count, so producers
+    should connect with it before calling push_tests_to_shards.
+    """
+    addresses = [parse_shard_host(address)
+                 for address in shard_hosts.split(",")]
+    if shard_count is None:
+        shard_count = len(addresses)
+    if shard_count < len(addresses):
+        raise ValueError("The shard count must not be smaller than the "
+                         "number of shard hosts")
+
+    clients = {}
+    for host, port in addresses:
+        if (host, port) not in clients:
+            clients[(host, port)] = redis.StrictRedis(host=host, port=port)
+
+    return [clients[addresses[index % len(addresses)]]
+            for index in range(shard_count)]
+
+
+def get_shard_connections(config):
+    """Return a list holding the redis connection of each shard."""
+    shard_count = config.getoption('redis_shard_count')
+    shard_hosts = config.getoption('redis_shard_hosts')
+    if shard_count is not None and shard_count < 1:
+        raise pytest.UsageError("--redis-shard-count must be at least 1")
+
+    if shard_hosts is None:
+        return [get_redis_connection(config)] * (shard_count or 1)
+
+    try:
+        return connect_to_shards(shard_hosts, shard_count)
+    except ValueError as error:
+        raise pytest.UsageError(str(error))
+
+
+def get_home_shard(config, shard_count):
+    """Return the index of the shard this run consumes from first."""
+    home_shard = config.getoption('redis_home_shard')
+    if home_shard is None:
+        # The pid is often the same in every container of a fleet,
+        # so pick at random to spread the workers over the shards.
+        return random.randrange(shard_count)
+    if not 0 <= home_shard < shard_count:
+        raise pytest.UsageError("--redis-home-shard must be between 0 "
+                                "and %d" % (shard_count - 1))
+    return home_shard
+
+
+def populate_test_generator(session, shard_connections):
+    """Create a test path generator that consumes from the main redis lists.
+
+    This first checks the backup list of every shard for any entries and
+    pushes them to the main redis list of that shard before returning a
+    generator over the shards.
     """
     redis_list_key = session.config.getoption("redis_list_key")
     backup_list_key = session.config.getoption("redis_backup_list_key")
+    shard_count = len(shard_connections)
 
-    if backup_list_key is not None and redis_connection.llen(backup_list_key) != 0:
-        # Push tests to the main redis list
-        while redis_connection.rpoplpush(backup_list_key, redis_list_key) is not None:
-            continue
+    if backup_list_key is not None:
+        for shard_index, redis_connection in enumerate(shard_connections):
+            shard_list_key = get_shard_key(redis_list_key,
+                                           shard_index,
+                                           shard_count)
+            shard_backup_key = get_shard_key(backup_list_key,
+                                             shard_index,
+                                             shard_count)
+            if redis_connection.llen(shard_backup_key) != 0:
+                # Push tests to the main redis list
+                while redis_connection.rpoplpush(shard_backup_key,
+                                                 shard_list_key) is not None:
+                    continue
 
     return redis_test_generator(session.config,
-                                redis_connection,
+                                shard_connections,
                                 redis_list_key,
                                 backup_list_key=backup_list_key)
 
@@ -90,10 +271,10 @@ def perform_collect_and_run(session):
     # This mimics the internal pytest collect loop, but shortened
     # while running tests as soon as they are found.
 
-    redis_connection = get_redis_connection(session.config)
+    shard_connections = get_shard_connections(session.config)
 
     redis_list = populate_test_generator(session,
-                                         redis_connection)
+                                         shard_connections)
 
     default_verbosity = session.config.option.verbose
     hook = session.config.hook
@@ -137,23 +318,48 @@ def perform_collect_and_run(session):
     return session.items
 
 
-def redis_test_generator(config, redis_connection, redis_list_key,
+def redis_test_generator(config, shard_connections, redis_list_key,
                          backup_list_key=None):
-    """A generator that pops and returns test paths from the redis list key."""
-    term = TerminalReporter(config)
-
-    val = retrieve_test_from_redis(redis_connection,
-                                   redis_list_key,
-                                   backup_list_key)
+    """A generator that pops and returns test paths from the redis list key.
 
-    if val is None:
-        term.write("No items in redis list '%s'\n" % redis_list_key)
+    The home shard is drained first, after which the remaining shards are
+    visited until they are all empty, starting from a random one so that
+    workers done with their home shard do not all steal from the same key.
+    """
+    term = TerminalReporter(config)
+    shard_count = len(shard_connections)
+    home_shard = get_home_shard(config, shard_count)
+    other_shards = [index for index in range(shard_count)
+                    if index != home_shard]
+    steal_start = random.randrange(len(other_shards)) if other_shards else 0
+    shard_order = ([home_shard] + other_shards[steal_start:] +
+                   other_shards[:steal_start])
+
+    found_item = False
+    for shard_index in shard_order:
+        redis_connection = shard_connections[shard_index]
+        shard_list_key = get_shard_key(redis_list_key,
+                                       shard_index,
+                                       shard_count)
+        shard_backup_key = get_shard_key(backup_list_key,
+                                         shard_index,
+                                         shard_count)
 
-    while val is not None:
-        yield val
         val = retrieve_test_from_redis(redis_connection,
-                                       redis_list_key,
-                                       backup_list_key)
+                                       shard_list_key,
+                                       shard_backup_key)
+        while val is not None:
+            found_item = True
+            yield val
+            val = retrieve_test_from_redis(redis_connection,
+                                           shard_list_key,
+                                           shard_backup_key)
+
+    if not found_item:
+        shard_list_keys = [get_shard_key(redis_list_key, index, shard_count)
+                           for index in shard_order]
+        term.write("No items in redis list '%s'\n" %
+                   "', '".join(shard_list_keys))
 
 
 def pytest_runtest_protocol(item, nextitem):
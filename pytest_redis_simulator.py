@@ -0,0 +1,254 @@
+"""Offline scheduling simulator for pytest-redis.
+
+Replays the durations recorded with --redis-record-durations against
+simulated workers to compare queue strategies without running any tests.
+
+The plugin runs every popped test with no next item, so all fixtures are
+torn down after each test and every test pays its full setup and
+teardown again. The
+fifo and longest-first strategies only change the order tests are pushed
+in and are simulated that way. The batched and module-affinity strategies
+assume a plugin that pops several tests at once and runs each batch with
+the next test of the batch as next item, so the module setup and teardown
+are only paid once per run of same-module tests within a batch.
+
+Usage:
+python -m pytest_redis_simulator <durations-file> [--workers 4 8 16]
+    [--batch-size 10] [--redis-latency 0.001]
+    [--strategies fifo batched longest-first module-affinity]
+"""
+import argparse
+import collections
+import heapq
+import json
+import sys
+
+
+STRATEGIES = collections.OrderedDict()
+
+Strategy = collections.namedtuple('Strategy', ['build_queue',
+                                               'amortises_setup'])
+
+Test = collections.namedtuple('Test', ['nodeid', 'module', 'duration',
+                                       'setup', 'teardown'])
+
+SimulationResult = collections.namedtuple('SimulationResult',
+                                          ['strategy', 'workers',
+                                           'makespan', 'idle_time',
+                                           'redis_ops'])
+
+
+def strategy(name, amortises_setup=False):
+    """Register a function building the queue of a strategy.
+
+    amortises_setup tells whether the module setup and teardown are shared
+    by the consecutive tests of a module within a popped batch.
+    """
+    def register(func):
+        STRATEGIES[name] = Strategy(build_queue=func,
+                                    amortises_setup=amortises_setup)
+        return func
+    return register
+
+
+def median(values):
+    """Return the median of a non-empty list of numbers."""
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def load_durations(path):
+    """Return the tests recorded in a durations file.
+
+    A test recorded several times, because several runs share the file or
+    because it was ran again from the backup list, is replayed once with
+    the median of its recorded durations. Tests are returned in the order
+    they were first recorded, which is the order their teardown completed
+    in across all workers and only approximates the order they were pushed.
+
+    The setup and teardown times shared by the tests of a module are
+    estimated as the smallest setup and teardown durations recorded for
+    that module and are split off from the duration of each of its tests.
+    """
+    recorded = collections.OrderedDict()
+    with open(path) as durations_file:
+        for line in durations_file:
+            line = line.strip()
+            if line:
+                record = json.loads(line)
+                recorded.setdefault(record['nodeid'], []).append(record)
+
+    records = []
+    for nodeid, runs in recorded.items():
+        record = {'nodeid': nodeid}
+        for phase in ('setup', 'call', 'teardown'):
+            record[phase] = median([run[phase] for run in runs])
+        records.append(record)
+
+    module_setup = {}
+    module_teardown = {}
+    for record in records:
+        module = record['nodeid'].split("::")[0]
+        module_setup[module] = min(record['setup'],
+                                   module_setup.get(module, record['setup']))
+        module_teardown[module] = min(record['teardown'],
+                                      module_teardown.get(module,
+                                                          record['teardown']))
+
+    tests = []
+    for record in records:
+        module = record['nodeid'].split("::")[0]
+        duration = record['setup'] + record['call'] + record['teardown']
+        tests.append(Test(nodeid=record['nodeid'],
+                          module=module,
+                          duration=(duration - module_setup[module] -
+                                    module_teardown[module]),
+                          setup=module_setup[module],
+                          teardown=module_teardown[module]))
+    return tests
+
+
+def chunks(tests, size):
+    """Split a list of tests in consecutive lists of at most size tests."""
+    return [tests[i:i + size] for i in range(0, len(tests), size)]
+
+
+@strategy('fifo')
+def fifo_queue(tests, batch_size):
+    """Pop one test at a time in the order they were first recorded."""
+    return [[test] for test in tests]
+
+
+@strategy('batched', amortises_setup=True)
+def batched_queue(tests, batch_size):
+    """Pop batch_size tests at a time in the order they were recorded."""
+    return chunks(tests, batch_size)
+
+
+@strategy('longest-first')
+def longest_first_queue(tests, batch_size):
+    """Pop one test at a time, longest first."""
+    return [[test] for test in sorted(tests,
+                                      key=lambda test: test.duration +
+                                      test.setup + test.teardown,
+                                      reverse=True)]
+
+
+@strategy('module-affinity', amortises_setup=True)
+def module_affinity_queue(tests, batch_size):
+    """Pop up to batch_size tests of the same module at a time."""
+    modules = collections.OrderedDict()
+    for test in tests:
+        modules.setdefault(test.module, []).append(test)
+
+    queue = []
+    for module_tests in modules.values():
+        queue.extend(chunks(module_tests, batch_size))
+    return queue
+
+
+def simulate(tests, strategy_name, workers, batch_size=1,
+             redis_latency=0.0):
+    """Simulate running the tests with the given strategy and workers.
+
+    Every pop costs a redis round trip of redis_latency seconds, including
+    the final pop of each worker that finds the queue empty. Strategies
+    that amortise setup pay the setup and teardown times of a module once
+    per run of consecutive tests of that module within a popped batch, the
+    others pay them for every test as the plugin does today.
+    """
+    chosen = STRATEGIES[strategy_name]
+    queue = collections.deque(chosen.build_queue(tests, batch_size))
+
+    busy_time = 0.0
+    redis_ops = 0
+    finish_times = []
+    # Workers ordered by the time they are next free to pop
+    free_workers = [(0.0, worker) for worker in range(workers)]
+    heapq.heapify(free_workers)
+
+    while free_workers:
+        now, worker = heapq.heappop(free_workers)
+        now += redis_latency
+        redis_ops += 1
+        if not queue:
+            finish_times.append(now)
+            continue
+
+        # Everything is torn down at the end of a popped batch
+        batch = queue.popleft()
+        for index, test in enumerate(batch):
+            run_time = test.duration
+            next_index = index + 1
+            if (not chosen.amortises_setup or index == 0 or
+                    batch[index - 1].module != test.module):
+                run_time += test.setup
+            if (not chosen.amortises_setup or next_index == len(batch) or
+                    batch[next_index].module != test.module):
+                run_time += test.teardown
+            now += run_time
+            busy_time += run_time
+        heapq.heappush(free_workers, (now, worker))
+
+    makespan = max(finish_times) if finish_times else 0.0
+    return SimulationResult(strategy=strategy_name,
+                            workers=workers,
+                            makespan=makespan,
+                            idle_time=makespan * workers - busy_time,
+                            redis_ops=redis_ops)
+
+
+def format_results(results):
+    """Return a table of simulation results."""
+    lines = ["%-16s %8s %12s %12s %10s" % ("strategy", "workers",
+                                           "makespan(s)", "idle(s)",
+                                           "redis ops")]
+    for result in results:
+        lines.append("%-16s %8d %12.2f %12.2f %10d" % result)
+    return "\n".join(lines)
+
+
+def parse_args(argv):
+    """Parse the simulator command line arguments."""
+    parser = argparse.ArgumentParser(
+        prog='python -m pytest_redis_simulator',
+        description=('Replay durations recorded with '
+                     '--redis-record-durations against simulated workers.'))
+    parser.add_argument('durations',
+                        help='The file written by --redis-record-durations.')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1],
+                        help='The numbers of workers to simulate.')
+    parser.add_argument('--batch-size', type=int, default=10,
+                        help=('The number of tests popped at once by the '
+                              'batched and module-affinity strategies.'))
+    parser.add_argument('--redis-latency', type=float, default=0.001,
+                        help='The round trip time of a redis pop in seconds.')
+    parser.add_argument('--strategies', nargs='+',
+                        choices=list(STRATEGIES.keys()),
+                        default=list(STRATEGIES.keys()),
+                        help='The queue strategies to compare.')
+    args = parser.parse_args(argv)
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    if min(args.workers) < 1:
+        parser.error("--workers must be at least 1")
+    return args
+
+
+def main(argv=None):
+    """Run the simulator from the command line."""
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    tests = load_durations(args.durations)
+    results = [simulate(tests, strategy_name, workers,
+                        batch_size=args.batch_size,
+                        redis_latency=args.redis_latency)
+               for workers in args.workers
+               for strategy_name in args.strategies]
+    print(format_results(results))
+
+
+if __name__ == '__main__':
+    main()
@@ -7,7 +7,7 @@ setup(
     author='Samy Abidib',
     author_email='abidibs@gmail.com',
     version='0.4.7',
-    py_modules=['pytest_redis'],
+    py_modules=['pytest_redis', 'pytest_redis_simulator'],
     url='https://github.com/sabidib/pytest-redis',
     license='MIT',
     description='A pytest plugin that pops test paths from a redis queue.',
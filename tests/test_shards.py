@@ -0,0 +1,253 @@
+"""Tests the pytest-redis shard arguments."""
+import pytest
+
+from _pytest.main import EXIT_OK, EXIT_USAGEERROR
+
+from conftest import clean_list, handle_existing_list
+import pytest_redis
+import utils
+
+
+NUM_SHARDS = 3
+
+
+def create_test_file(testdir):
+    """Create test file and return array of paths to tests."""
+    test_filename = "test_shard_file.py"
+    test_names = ["test_shard_%d" % i for i in range(2 * NUM_SHARDS)]
+    test_filename_contents = "".join("""
+        def {}():
+            assert True
+    """.format(test_name) for test_name in test_names)
+    utils.create_test_file(testdir, test_filename, test_filename_contents)
+    return [test_filename + "::" + test_name for test_name in test_names]
+
+
+def get_shard_keys(key):
+    """Return the keys of every shard of the given key."""
+    return [pytest_redis.get_shard_key(key, i, NUM_SHARDS)
+            for i in range(NUM_SHARDS)]
+
+
+def get_args_for_shards(redis_args, home_shard):
+    """Return args for the shard tests."""
+    return utils.get_standard_args(redis_args) + [
+        "--redis-shard-count=%d" % NUM_SHARDS,
+        "--redis-home-shard=%d" % home_shard
+    ]
+
+
+def get_shard_tests(file_paths_to_test, shard):
+    """Return the tests push_tests_to_shards pushes to a shard, in order."""
+    return file_paths_to_test[shard::NUM_SHARDS]
+
+
+def get_passed_tests(result):
+    """Return the test paths reported as passed, in the order they ran."""
+    return [line.split(" ")[0] for line in result.outlines
+            if line.endswith(" PASSED")]
+
+
+def assert_ran_home_shard_first(result, file_paths_to_test, home_shard):
+    """Check the home shard ran first and every shard was drained in order."""
+    passed = get_passed_tests(result)
+    assert sorted(passed) == sorted(file_paths_to_test)
+
+    shard_tests = get_shard_tests(file_paths_to_test, home_shard)
+    assert passed[:len(shard_tests)] == shard_tests
+    for shard in range(NUM_SHARDS):
+        shard_tests = get_shard_tests(file_paths_to_test, shard)
+        start = passed.index(shard_tests[0])
+        assert passed[start:start + len(shard_tests)] == shard_tests
+
+
+def get_config(testdir, redis_args, *args):
+    """Return the pytest config for the redis args and extra args."""
+    return testdir.parseconfig(*(utils.get_standard_args(redis_args) +
+                                 list(args)))
+
+
+@pytest.yield_fixture
+def shard_connections(redis_connection, redis_args, force_del_lists):
+    """Return a connection per shard and clean the shard lists after."""
+    shard_keys = (get_shard_keys(redis_args["redis-list-key"]) +
+                  get_shard_keys(redis_args["redis-backup-list-key"]))
+    for key in shard_keys:
+        handle_existing_list(redis_connection, force_del_lists, key)
+
+    yield [redis_connection] * NUM_SHARDS
+    for key in shard_keys:
+        clean_list(redis_connection, key)
+
+
+def test_get_shard_key():
+    """A single shard uses the list key as is."""
+    assert pytest_redis.get_shard_key("tests", 0, 1) == "tests"
+    assert pytest_redis.get_shard_key("tests", 2, 4) == "tests:2"
+    assert pytest_redis.get_shard_key(None, 2, 4) is None
+
+
+def test_push_tests_to_shards(testdir, shard_connections, redis_args):
+    """Ensure test paths are spread evenly across the shards."""
+    file_paths_to_test = create_test_file(testdir)
+    pytest_redis.push_tests_to_shards(shard_connections,
+                                      redis_args["redis-list-key"],
+                                      file_paths_to_test)
+
+    for i, shard_key in enumerate(get_shard_keys(
+            redis_args["redis-list-key"])):
+        assert shard_connections[i].llen(shard_key) == 2
+
+
+def test_run_from_all_shards(testdir, shard_connections, redis_args):
+    """Ensure the home shard is drained first then the others are stolen."""
+    file_paths_to_test = create_test_file(testdir)
+    pytest_redis.push_tests_to_shards(shard_connections,
+                                      redis_args["redis-list-key"],
+                                      file_paths_to_test)
+    home_shard = 1
+    py_test_args = get_args_for_shards(redis_args, home_shard)
+
+    result = testdir.runpytest(*py_test_args)
+
+    assert result.ret == EXIT_OK
+    assert_ran_home_shard_first(result, file_paths_to_test, home_shard)
+    for shard_key in get_shard_keys(redis_args["redis-list-key"]):
+        assert shard_connections[0].llen(shard_key) == 0
+
+
+def test_run_shards_multiple_times_with_backup(testdir, shard_connections,
+                                               redis_args):
+    """Ensure every shard keeps its own backup list."""
+    file_paths_to_test = create_test_file(testdir)
+    pytest_redis.push_tests_to_shards(shard_connections,
+                                      redis_args["redis-list-key"],
+                                      file_paths_to_test)
+    py_test_args = get_args_for_shards(redis_args, 0) + [
+        "--redis-backup-list-key=" + redis_args["redis-backup-list-key"]
+    ]
+
+    for i in range(3):
+        result = testdir.runpytest(*py_test_args)
+        assert_ran_home_shard_first(result, file_paths_to_test, 0)
+        for shard_key in get_shard_keys(
+                redis_args["redis-backup-list-key"]):
+            assert shard_connections[0].llen(shard_key) == 2
+
+
+def test_no_items_in_shards(testdir, shard_connections, redis_args):
+    """The shard keys checked are reported when every shard is empty."""
+    py_test_args = get_args_for_shards(redis_args, 0)
+
+    result = testdir.runpytest(*py_test_args)
+
+    assert result.ret == EXIT_OK
+    result.stdout.fnmatch_lines(["No items in redis list*"])
+    for shard_key in get_shard_keys(redis_args["redis-list-key"]):
+        assert shard_key in result.stdout.str()
+
+
+def test_get_shard_connections_hosts(testdir, redis_args):
+    """Shards are spread round-robin over the given hosts."""
+    config = get_config(testdir, redis_args,
+                        "--redis-shard-count=3",
+                        "--redis-shard-hosts=host-a:1234, host-b:5678")
+
+    connections = pytest_redis.get_shard_connections(config)
+
+    addresses = [(c.connection_pool.connection_kwargs['host'],
+                  c.connection_pool.connection_kwargs['port'])
+                 for c in connections]
+    assert addresses == [("host-a", 1234), ("host-b", 5678),
+                         ("host-a", 1234)]
+    assert connections[0] is connections[2]
+
+
+def test_connect_to_shards_without_config():
+    """Producers get the same shard to host mapping as the workers."""
+    connections = pytest_redis.connect_to_shards("host-a:1234,[::1]:5678", 3)
+
+    addresses = [(c.connection_pool.connection_kwargs['host'],
+                  c.connection_pool.connection_kwargs['port'])
+                 for c in connections]
+    assert addresses == [("host-a", 1234), ("::1", 5678), ("host-a", 1234)]
+    assert len(pytest_redis.connect_to_shards("host-a:1,host-b:2")) == 2
+
+
+@pytest.mark.parametrize("shard_hosts", [
+    "host-without-port",
+    "host-a:port",
+    "::1:6379",
+    "[::1]",
+])
+def test_connect_to_shards_invalid_hosts(shard_hosts):
+    """Addresses that are not host:port or [ipv6]:port are rejected."""
+    with pytest.raises(ValueError):
+        pytest_redis.connect_to_shards(shard_hosts)
+
+
+def test_get_shard_connections_defaults_to_host_count(testdir, redis_args):
+    """Without a shard count there is one shard per host."""
+    config = get_config(testdir, redis_args,
+                        "--redis-shard-hosts=host-a:1234,host-b:5678")
+
+    assert len(pytest_redis.get_shard_connections(config)) == 2
+
+
+def test_get_shard_connections_without_hosts(testdir, redis_args):
+    """Every shard uses redis-host and redis-port by default."""
+    config = get_config(testdir, redis_args, "--redis-shard-count=3")
+
+    connections = pytest_redis.get_shard_connections(config)
+
+    assert len(connections) == 3
+    for connection in connections:
+        kwargs = connection.connection_pool.connection_kwargs
+        assert kwargs['host'] == redis_args['redis-host']
+        assert str(kwargs['port']) == str(redis_args['redis-port'])
+
+
+@pytest.mark.parametrize("extra_args", [
+    ["--redis-shard-hosts=host-without-port"],
+    ["--redis-shard-hosts=:1234"],
+    ["--redis-shard-hosts=::1:6379"],
+    ["--redis-shard-count=0"],
+    ["--redis-shard-count=1", "--redis-shard-hosts=host-a:1,host-b:2"],
+])
+def test_get_shard_connections_usage_errors(testdir, redis_args,
+                                            extra_args):
+    """Invalid shard options are usage errors."""
+    config = get_config(testdir, redis_args, *extra_args)
+
+    with pytest.raises(pytest.UsageError):
+        pytest_redis.get_shard_connections(config)
+
+
+@pytest.mark.parametrize("home_shard", [-1, NUM_SHARDS])
+def test_get_home_shard_out_of_range(testdir, redis_args, home_shard):
+    """The home shard must be the index of a shard."""
+    config = get_config(testdir, redis_args,
+                        "--redis-home-shard=%d" % home_shard)
+
+    with pytest.raises(pytest.UsageError):
+        pytest_redis.get_home_shard(config, NUM_SHARDS)
+
+
+def test_get_home_shard_default(testdir, redis_args):
+    """The default home shard is one of the shards."""
+    config = get_config(testdir, redis_args)
+
+    for _ in range(20):
+        assert 0 <= pytest_redis.get_home_shard(config, NUM_SHARDS) < \
+            NUM_SHARDS
+
+
+def test_invalid_shard_count_exits_with_usage_error(testdir, redis_args):
+    """A run with an invalid shard count stops with a usage error."""
+    py_test_args = utils.get_standard_args(redis_args) + [
+        "--redis-shard-count=0"
+    ]
+
+    result = testdir.runpytest(*py_test_args)
+
+    assert result.ret == EXIT_USAGEERROR
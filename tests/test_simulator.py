@@ -0,0 +1,237 @@
+"""Tests the duration recording and the pytest-redis scheduling simulator."""
+import json
+
+import pytest
+
+import pytest_redis_simulator
+import utils
+
+
+def write_durations(tmpdir, records):
+    """Write a durations file with the given records and return its path."""
+    path = tmpdir.join("durations.jsonl")
+    path.write("".join(json.dumps(record) + "\n" for record in records))
+    return str(path)
+
+
+def make_record(nodeid, setup, call, teardown=0.0):
+    """Return a record as written by --redis-record-durations."""
+    return {'nodeid': nodeid, 'worker': 1, 'setup': setup,
+            'call': call, 'teardown': teardown}
+
+
+def test_record_durations(testdir, redis_connection, redis_args):
+    """Ensure a line is recorded for every test ran."""
+    test_file_name = "test_record.py"
+    utils.create_test_file(testdir, test_file_name, """
+        def test_first():
+            assert True
+        def test_second():
+            assert False
+    """)
+    for test_name in ["test_first", "test_second"]:
+        redis_connection.lpush(redis_args['redis-list-key'],
+                               test_file_name + "::" + test_name)
+    durations_path = str(testdir.tmpdir.join("durations.jsonl"))
+    py_test_args = utils.get_standard_args(redis_args) + [
+        "--redis-record-durations=" + durations_path
+    ]
+
+    testdir.runpytest(*py_test_args)
+
+    with open(durations_path) as durations_file:
+        records = [json.loads(line) for line in durations_file]
+    assert [record['nodeid'] for record in records] == [
+        test_file_name + "::test_first", test_file_name + "::test_second"
+    ]
+    for record in records:
+        assert record['call'] >= 0.0
+
+
+def test_load_durations_splits_module_setup(tmpdir):
+    """The smallest setup of a module is shared by its tests."""
+    path = write_durations(tmpdir, [
+        make_record("test_a.py::test_1", 2.0, 1.0),
+        make_record("test_a.py::test_2", 1.0, 1.0),
+    ])
+
+    tests = pytest_redis_simulator.load_durations(path)
+
+    assert [test.setup for test in tests] == [1.0, 1.0]
+    assert [test.duration for test in tests] == [2.0, 1.0]
+
+
+def test_load_durations_splits_module_teardown(tmpdir):
+    """The smallest teardown of a module is shared by its tests."""
+    path = write_durations(tmpdir, [
+        make_record("test_a.py::test_1", 0.0, 1.0, 3.0),
+        make_record("test_a.py::test_2", 0.0, 1.0, 1.0),
+    ])
+
+    tests = pytest_redis_simulator.load_durations(path)
+
+    assert [test.teardown for test in tests] == [1.0, 1.0]
+    assert [test.duration for test in tests] == [3.0, 1.0]
+
+
+def test_batched_shares_setup_and_teardown(tmpdir):
+    """A batch pays the module setup and teardown once."""
+    path = write_durations(tmpdir, [
+        make_record("a.py::test_1", 1.0, 0.0, 1.0),
+        make_record("a.py::test_2", 1.0, 0.0, 1.0),
+    ])
+    tests = pytest_redis_simulator.load_durations(path)
+
+    fifo = pytest_redis_simulator.simulate(tests, 'fifo', 1)
+    batched = pytest_redis_simulator.simulate(tests, 'batched', 1,
+                                              batch_size=2)
+
+    assert fifo.makespan == 4.0
+    assert batched.makespan == 2.0
+
+
+def test_simulate_fifo(tmpdir):
+    """Each pop costs a round trip and idle workers are accounted for."""
+    path = write_durations(tmpdir, [
+        make_record("test_a.py::test_%d" % i, 0.0, 1.0) for i in range(3)
+    ])
+    tests = pytest_redis_simulator.load_durations(path)
+
+    result = pytest_redis_simulator.simulate(tests, 'fifo', 2,
+                                             redis_latency=0.5)
+
+    assert result.redis_ops == 5
+    assert result.makespan == 3.5
+    assert result.idle_time == 4.0
+
+
+def test_simulate_batched_pops_less(tmpdir):
+    """Batched pops make fewer round trips than single pops."""
+    path = write_durations(tmpdir, [
+        make_record("test_a.py::test_%d" % i, 0.0, 1.0) for i in range(10)
+    ])
+    tests = pytest_redis_simulator.load_durations(path)
+
+    result = pytest_redis_simulator.simulate(tests, 'batched', 1,
+                                             batch_size=5)
+
+    assert result.redis_ops == 3
+    assert result.makespan == 10.0
+
+
+def test_simulate_longest_first(tmpdir):
+    """Running the longest test first shortens the makespan."""
+    path = write_durations(tmpdir, [
+        make_record("test_a.py::test_short_1", 0.0, 1.0),
+        make_record("test_a.py::test_short_2", 0.0, 1.0),
+        make_record("test_a.py::test_long", 0.0, 2.0),
+    ])
+    tests = pytest_redis_simulator.load_durations(path)
+
+    fifo = pytest_redis_simulator.simulate(tests, 'fifo', 2)
+    longest_first = pytest_redis_simulator.simulate(tests, 'longest-first', 2)
+
+    assert fifo.makespan == 3.0
+    assert longest_first.makespan == 2.0
+
+
+def test_simulate_module_affinity(tmpdir):
+    """Module setup is only paid when a worker switches module."""
+    path = write_durations(tmpdir, [
+        make_record("test_a.py::test_1", 1.0, 1.0),
+        make_record("test_b.py::test_1", 1.0, 1.0),
+        make_record("test_a.py::test_2", 1.0, 1.0),
+        make_record("test_b.py::test_2", 1.0, 1.0),
+    ])
+    tests = pytest_redis_simulator.load_durations(path)
+
+    fifo = pytest_redis_simulator.simulate(tests, 'fifo', 1)
+    affinity = pytest_redis_simulator.simulate(tests, 'module-affinity', 1,
+                                               batch_size=2)
+
+    assert fifo.makespan == 8.0
+    assert affinity.makespan == 6.0
+
+
+def test_fifo_charges_setup_for_every_test(tmpdir):
+    """The plugin tears everything down after each test."""
+    path = write_durations(tmpdir, [
+        make_record("t_a.py::test_1", 0.5, 2.0),
+        make_record("t_a.py::test_2", 0.5, 2.0),
+        make_record("t_b.py::test_1", 0.5, 1.0),
+    ])
+    tests = pytest_redis_simulator.load_durations(path)
+
+    result = pytest_redis_simulator.simulate(tests, 'fifo', 1)
+
+    assert result.makespan == 6.5
+
+
+def test_load_durations_deduplicates_tests(tmpdir):
+    """A test recorded several times is replayed once with its median."""
+    path = write_durations(tmpdir, [
+        make_record("test_a.py::test_1", 0.0, 1.0),
+        make_record("test_a.py::test_2", 0.0, 5.0),
+        make_record("test_a.py::test_1", 0.0, 2.0),
+        make_record("test_a.py::test_1", 0.0, 9.0),
+    ])
+
+    tests = pytest_redis_simulator.load_durations(path)
+
+    assert [test.nodeid for test in tests] == ["test_a.py::test_1",
+                                               "test_a.py::test_2"]
+    assert [test.duration for test in tests] == [2.0, 5.0]
+
+
+@pytest.mark.parametrize("argv", [
+    ["durations.jsonl", "--batch-size=0"],
+    ["durations.jsonl", "--workers", "2", "0"],
+    ["durations.jsonl", "--strategies", "unknown"],
+])
+def test_parse_args_errors(argv):
+    """Invalid simulator arguments exit with an error."""
+    with pytest.raises(SystemExit) as excinfo:
+        pytest_redis_simulator.parse_args(argv)
+    assert excinfo.value.code == 2
+
+
+def test_parse_args_defaults():
+    """Every strategy is compared by default."""
+    args = pytest_redis_simulator.parse_args(["durations.jsonl"])
+
+    assert args.durations == "durations.jsonl"
+    assert args.workers == [1]
+    assert args.strategies == list(pytest_redis_simulator.STRATEGIES.keys())
+
+
+def test_format_results():
+    """Results are formatted as one table row per simulation."""
+    result = pytest_redis_simulator.SimulationResult(strategy='fifo',
+                                                     workers=4,
+                                                     makespan=12.345,
+                                                     idle_time=1.5,
+                                                     redis_ops=104)
+
+    lines = pytest_redis_simulator.format_results([result]).split("\n")
+
+    assert lines[0].split() == ["strategy", "workers", "makespan(s)",
+                                "idle(s)", "redis", "ops"]
+    assert lines[1].split() == ["fifo", "4", "12.35", "1.50", "104"]
+
+
+def test_main(tmpdir, capsys):
+    """The simulator prints a row per strategy and worker count."""
+    path = write_durations(tmpdir, [
+        make_record("test_a.py::test_%d" % i, 0.0, 1.0) for i in range(4)
+    ])
+
+    pytest_redis_simulator.main([path, "--workers", "1", "2",
+                                 "--strategies", "fifo", "batched",
+                                 "--redis-latency=0"])
+
+    out, _ = capsys.readouterr()
+    rows = [line.split() for line in out.splitlines()[1:]]
+    assert [row[:3] for row in rows] == [["fifo", "1", "4.00"],
+                                         ["batched", "1", "4.00"],
+                                         ["fifo", "2", "2.00"],
+                                         ["batched", "2", "4.00"]]